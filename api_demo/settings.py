@@ -82,6 +82,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    # Adds ETags to GET responses and answers matching requests with 304
+    "django.middleware.http.ConditionalGetMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -117,6 +119,9 @@ WSGI_APPLICATION = "api_demo.wsgi.application"
 DATABASES = {
     "default": env.db(default="postgres://localhost/api_demo")
 }
+# Reuse database connections across requests, instead of connecting anew
+# for every one. Override with `?CONN_MAX_AGE=...` in the DATABASE_URL.
+DATABASES["default"].setdefault("CONN_MAX_AGE", 60)
 
 
 # Password validation
@@ -10,7 +10,12 @@ https://docs.djangoproject.com/en/2.0/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.urls import reverse
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "api_demo.settings")
 
 application = get_wsgi_application()
+
+# Import the URLconf and build the resolver's lookup tables (compiling
+# the URL patterns) while the worker boots, not on its first request.
+reverse("api-root")
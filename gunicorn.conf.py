@@ -1,6 +1,9 @@
 # Gunicorn configuration file
 
 import os
+import warnings
+
+from gunicorn.config import KNOWN_SETTINGS
 
 # Defaults
 # Refer to http://docs.gunicorn.org/en/stable/settings.html for details
@@ -11,8 +14,32 @@ accesslog = "-"
 errorlog = "-"
 loglevel = "info"
 
+
+def _env_settings():
+    """
+    Return the settings overridden with GUNICORN_* environment variables.
+
+    Any setting can be overridden (e.g. GUNICORN_WORKERS=4), the names
+    come from gunicorn's own registry. The values are kept as strings,
+    gunicorn validates and converts them on its own.
+
+    Warns about GUNICORN_* variables that match no setting, except for
+    GUNICORN_CMD_ARGS, which gunicorn reads by itself.
+    """
+    names = {
+        "GUNICORN_" + setting.name.upper(): setting.name
+        for setting in KNOWN_SETTINGS
+    }
+    for var in sorted(os.environ.keys() - names.keys()):
+        if var.startswith("GUNICORN_") and var != "GUNICORN_CMD_ARGS":
+            warnings.warn(f"Ignoring {var}, gunicorn has no such setting")
+    return {
+        name: os.environ[var]
+        for var, name in names.items()
+        if var in os.environ
+    }
+
+
 # Load from GUNICORN_* environment variables
-for k, v in os.environ.items():
-    if k.startswith("GUNICORN_"):
-        key = k.split("_", 1)[1].lower()
-        locals()[key] = v
+globals().update(_env_settings())
+del _env_settings
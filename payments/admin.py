@@ -29,4 +29,5 @@ class PaymentAdmin(admin.ModelAdmin):
     list_display = (
         "time", "from_account", "to_account", "amount", "confirmed",
     )
+    list_select_related = ("from_account", "to_account")
     search_fields = ("unique_id",)
@@ -1,9 +1,60 @@
+import collections
+
 import django_filters
+from django_filters.rest_framework import DjangoFilterBackend
 from django_filters.widgets import BooleanWidget
 
 from . import models
 
 
+# Cache of FilterSet subclasses, keyed by (FilterSet, filter names) pairs
+_filter_subsets = {}
+
+
+class FilterBackend(DjangoFilterBackend):
+    """
+    A DjangoFilterBackend that only pays for the filters that are requested.
+
+    Constructing a FilterSet instance is not free, as it copies all the
+    declared filters and builds a form. This backend doesn't do this at all
+    when the request has no query parameters the filter set knows about.
+    Otherwise, it uses a (cached) FilterSet subclass that only has
+    the filters present in the request.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        """Filter the queryset, unless no filter parameters were provided."""
+        filter_class = self.get_filter_class(view, queryset)
+        if filter_class is None:
+            return queryset
+
+        names = frozenset(
+            request.query_params.keys() & filter_class.base_filters.keys()
+        )
+        if not names:
+            return queryset
+
+        filter_class = self.get_filter_subset_class(filter_class, names)
+        return filter_class(
+            request.query_params, queryset=queryset, request=request
+        ).qs
+
+    @staticmethod
+    def get_filter_subset_class(filter_class, names):
+        """Return a subclass of `filter_class` with only `names` filters."""
+        key = (filter_class, names)
+        subset_class = _filter_subsets.get(key, None)
+        if subset_class is None:
+            subset_class = type(filter_class.__name__, (filter_class,), {})
+            # The metaclass sets base_filters, so we must override it after
+            subset_class.base_filters = collections.OrderedDict(
+                (name, f) for name, f in filter_class.base_filters.items()
+                if name in names
+            )
+            _filter_subsets[key] = subset_class
+        return subset_class
+
+
 class AccountFilter(django_filters.FilterSet):
     """Filter set for Accounts API endpoint."""
 
@@ -58,7 +109,7 @@ class PaymentFilter(django_filters.FilterSet):
         # will be used with its own default widget, and that doesn't
         # recognize lowercase "true" and "false" and has other oddities.
         # https://github.com/encode/django-rest-framework/issues/2122
-        name="currency", widget=BooleanWidget,
+        name="confirmed", widget=BooleanWidget,
         help_text="Whenever to look only for confirmed (`true`)"
                   " or unconfirmed (`false`) payments only"
     )
@@ -0,0 +1,17 @@
+# Generated by Django 2.0 on 2026-10-15 09:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_add_payment_confirmed_field'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['confirmed', '-id'], name='payment_confirmed_id_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.0 on 2026-10-15 09:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_add_payment_confirmed_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['from_account', '-id'], name='payment_from_account_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['to_account', '-id'], name='payment_to_account_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['-time'], name='payment_time_idx'),
+        ),
+        # The indexes above start with the account columns, so the plain
+        # foreign key indexes are redundant
+        migrations.AlterField(
+            model_name='payment',
+            name='from_account',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='payments_from', to='payments.Account'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='to_account',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='payments_to', to='payments.Account'),
+        ),
+    ]
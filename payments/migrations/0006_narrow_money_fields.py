@@ -0,0 +1,66 @@
+# Generated by Django 2.0 on 2026-10-15 09:24
+
+from decimal import Decimal
+from django.db import migrations
+import payments.models
+
+
+# The money columns that lose precision, per model
+NARROWED_FIELDS = {
+    'Account': ('balance',),
+    'Payment': ('amount', 'source_balance_before',
+                'destination_balance_before'),
+}
+QUANTUM = Decimal('1e-8')
+
+
+def check_precision(apps, schema_editor):
+    """Refuse to narrow the columns if that would round any stored values.
+
+    Balances, payment amounts and balance history are rounded separately,
+    so the ledger could stop adding up. Such rows must be fixed manually.
+    """
+    for model_name, field_names in NARROWED_FIELDS.items():
+        model = apps.get_model('payments', model_name)
+        for field_name in field_names:
+            values = model.objects.using(
+                schema_editor.connection.alias
+            ).exclude(**{field_name: None}).values_list(field_name, flat=True)
+            for value in values.iterator():
+                if value != value.quantize(QUANTUM):
+                    raise RuntimeError(
+                        f'{model_name}.{field_name} has values with more '
+                        f'than 8 decimal places (e.g. {value}), refusing '
+                        f'to round them'
+                    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_add_payment_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_precision, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='account',
+            name='balance',
+            field=payments.models.MoneyField(currency_field_name='currency', decimal_places=8, default=Decimal('0.0'), default_currency='USD', editable=False, max_digits=26),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='amount',
+            field=payments.models.MoneyField(currency_field_name='currency', decimal_places=8, default=Decimal('0.0'), default_currency='USD', max_digits=26),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='destination_balance_before',
+            field=payments.models.MoneyField(currency_field_name='currency', decimal_places=8, default=None, default_currency='USD', max_digits=26, null=True),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='source_balance_before',
+            field=payments.models.MoneyField(currency_field_name='currency', decimal_places=8, default=None, default_currency='USD', max_digits=26, null=True),
+        ),
+    ]
@@ -11,12 +11,16 @@ class MoneyField(djmoney.models.fields.MoneyField):
     This class also adds convenience/shortcut argument ``shared_currency``.
     When set to ``True`` it's essentially ``currency_field_name="currency"``.
     The default is ``False`` to avoid possible confusion.
+
+    The default precision is the smallest unit of the most fine-grained
+    supported currency (XBT, 8 decimal places). Keeping numbers no wider
+    than necessary makes database arithmetic and comparisons cheaper.
     """
 
     def __init__(self, verbose_name=None, name=None, **kwargs):
         """Initialize MoneyField with useful defaults."""
-        kwargs.setdefault("max_digits", 36)
-        kwargs.setdefault("decimal_places", 18)
+        kwargs.setdefault("max_digits", 26)
+        kwargs.setdefault("decimal_places", 8)
         kwargs.setdefault("default_currency", "USD")
         if kwargs.pop("shared_currency", False):
             kwargs.setdefault("currency_field_name", "currency")
@@ -68,13 +72,14 @@ class Payment(models.Model):
     """
 
     # Essential properties (where from, where to, amount)
+    # The accounts are indexed by the composite indexes in Meta instead
     from_account = models.ForeignKey(
         Account, blank=True, null=True, on_delete=models.CASCADE,
-        related_name="payments_from"
+        related_name="payments_from", db_index=False
     )
     to_account = models.ForeignKey(
         Account, blank=True, null=True, on_delete=models.CASCADE,
-        related_name="payments_to"
+        related_name="payments_to", db_index=False
     )
     amount = MoneyField(shared_currency=True)
 
@@ -90,18 +95,41 @@ class Payment(models.Model):
     source_balance_before = MoneyField(null=True, shared_currency=True)
     destination_balance_before = MoneyField(null=True, shared_currency=True)
 
+    class Meta:
+        # Pagination always goes by the descending PK, so the indexes
+        # for the filterable fields have it as the second column.
+        # Confirmations update `confirmed`, so it's indexed only once.
+        indexes = [
+            models.Index(
+                fields=["confirmed", "-id"],
+                name="payment_confirmed_id_idx"
+            ),
+            models.Index(
+                fields=["from_account", "-id"],
+                name="payment_from_account_id_idx"
+            ),
+            models.Index(
+                fields=["to_account", "-id"],
+                name="payment_to_account_id_idx"
+            ),
+            models.Index(
+                fields=["-time"],
+                name="payment_time_idx"
+            ),
+        ]
+
     def __str__(self):
         """Return a short string describing the payment. Not i18n-aware."""
-        amount = str(self.amount)
-        source = str(self.from_account)
-        destination = str(self.to_account)
-
-        if self.from_account is None:
-            return f"Deposit {amount} to {destination}"
-        elif self.to_account is None:
-            return f"Withdraw {amount} from {source}"
+        # Check the `*_id` attributes, so we only fetch accounts we need
+        if self.from_account_id is None:
+            return f"Deposit {self.amount} to {self.to_account}"
+        elif self.to_account_id is None:
+            return f"Withdraw {self.amount} from {self.from_account}"
         else:
-            return f"Transfer {amount} from {source} to {destination}"
+            return (
+                f"Transfer {self.amount}"
+                f" from {self.from_account} to {self.to_account}"
+            )
 
     def confirm(self, commit: bool = True,
                 from_account: Account = None,
@@ -125,27 +153,57 @@ class Payment(models.Model):
             # TODO: Possibly, use a ValueError subclass AlreadyConfirmedError?
             raise ValueError("Payment is already confirmed")
 
+        # Compare the PKs, so we don't fetch the accounts we already have
         if from_account is None:
             from_account = self.from_account
-        elif self.from_account is None or from_account != self.from_account:
+        elif from_account.pk != self.from_account_id:
             raise RuntimeError("Provided from_account does not match")
+        else:
+            self.from_account = from_account
 
         if to_account is None:
             to_account = self.to_account
-        elif self.to_account is None or to_account != self.to_account:
+        elif to_account.pk != self.to_account_id:
             raise RuntimeError("Provided to_account does not match")
+        else:
+            self.to_account = to_account
+
+        if from_account is not None and from_account.balance < self.amount:
+            raise ValueError("Insufficient funds")
+
+        # Balances are adjusted by the database, with a single UPDATE for
+        # both accounts, so even a stale `balance` value won't result in
+        # lost updates or overdrafts. Still, the accounts should be locked,
+        # or `*_balance_before` may be wrong. If the database disagrees
+        # about the funds, the transaction must be rolled back.
+        amount = self.amount.amount
+        deltas = {}  # Account PK -> balance change
+        if from_account is not None:
+            deltas[from_account.pk] = -amount
+        if to_account is not None:
+            deltas[to_account.pk] = deltas.get(to_account.pk, 0) + amount
+        accounts = Account.objects.filter(pk__in=deltas)
+        if from_account is not None:
+            accounts = accounts.exclude(
+                pk=from_account.pk, balance__lt=amount
+            )
+        updated = accounts.update(balance=models.Case(
+            *(
+                models.When(pk=pk, then=models.F("balance") + delta)
+                for pk, delta in deltas.items()
+            ),
+            default=models.F("balance")
+        )) if deltas else 0
+        if updated != len(deltas):
+            raise ValueError("Insufficient funds")
 
         self.confirmed = True
         if from_account is not None:
-            if from_account.balance < self.amount:
-                raise ValueError("Insufficient funds")
             self.source_balance_before = from_account.balance
             from_account.balance -= self.amount
-            from_account.save(update_fields=["balance"])
         if to_account is not None:
             self.destination_balance_before = to_account.balance
             to_account.balance += self.amount
-            to_account.save(update_fields=["balance"])
 
         if commit:
             self.save()
@@ -1,7 +1,9 @@
 import base64
 import collections
+import functools
 import re
 from typing import Optional
+from urllib import parse
 
 import coreapi
 
@@ -12,7 +14,51 @@ from django.utils.encoding import force_text
 from rest_framework import pagination
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework.utils.urls import replace_query_param
+
+
+_DIGITS_RE = re.compile(r"^\d+$")
+# Encoded cursors are always 8 bytes, that is 11 unpadded base64 characters
+_CURSOR_RE = re.compile(r"[A-Za-z0-9_-]{11}")
+
+# Maps cursor comparisons to Django QuerySet lookup names
+_CMP_NAMES = {
+    ">": "gt",
+    "<": "lt",
+    ">=": "gte",
+    "<=": "lte",
+}
+
+# Encoded cursors are 64-bit numbers, with the comparison in the top two bits
+# and the PK in the rest. See `Cursor.encode` and `Cursor.decode`.
+_CMP_BITS = {
+    ">": 0,
+    "<": 1,
+    ">=": 2,
+    "<=": 3,
+}
+_BITS_CMP = {bits: cmp for cmp, bits in _CMP_BITS.items()}
+_PK_BITS = 62
+_PK_MASK = (1 << _PK_BITS) - 1
+
+
+@functools.lru_cache(maxsize=1024)
+def _encode_cursor(cmp: str, pk: int) -> str:
+    """Encode the cursor data. Memoized, as links often share cursors."""
+    if not 0 <= pk <= _PK_MASK:
+        raise ValueError("Cursor PK value is out of range")
+    value = (_CMP_BITS[cmp] << _PK_BITS) | pk
+    return base64.urlsafe_b64encode(
+        value.to_bytes(8, "big")
+    ).rstrip(b"=").decode("ascii")
+
+
+@functools.lru_cache(maxsize=1024)
+def _decode_cursor(text: str) -> "Cursor":
+    """Decode the cursor data. Memoized, as clients often reuse links."""
+    if not _CURSOR_RE.fullmatch(text):
+        raise ValueError("Invalid cursor value")
+    value = int.from_bytes(base64.urlsafe_b64decode(text + "="), "big")
+    return Cursor(cmp=_BITS_CMP[value >> _PK_BITS], pk=value & _PK_MASK)
 
 
 class Cursor(collections.namedtuple("Cursor", "cmp pk")):
@@ -27,6 +73,13 @@ class Cursor(collections.namedtuple("Cursor", "cmp pk")):
     See `MonotonicCursorPagination` for more details.
     """
 
+    __slots__ = ()
+
+    @property
+    def cmp_name(self) -> str:
+        """Return the comparision name usable with Django QuerySet filters."""
+        return _CMP_NAMES[self.cmp]
+
     @classmethod
     def decode(cls, text: str) -> "Cursor":
         """
@@ -39,41 +92,19 @@ class Cursor(collections.namedtuple("Cursor", "cmp pk")):
         :return: The decoded Cursor instance (or a subclass).
         :raises ValueError: In case of any problems with the encoded data
         """
-        try:
-            padded_text = text + "=" * (-len(text) % 4)
-            data = base64.urlsafe_b64decode(padded_text).decode("ascii")
-        except UnicodeDecodeError:
-            raise ValueError("Invalid cursor value")
-        m = re.match(r"^([><]=?)(\d+)$", data)
-        if not m:
-            raise ValueError("Invalid cursor value")
-        return cls(
-            cmp=m.group(1),
-            pk=int(m.group(2))
-        )
+        if cls is not Cursor:
+            return cls(*_decode_cursor(text))
+        return _decode_cursor(text)
 
     def encode(self) -> str:
         """
         Encode the Cursor as a string.
 
         The data can be decoded back using `Cursor.decode` method.
-        """
-        return base64.urlsafe_b64encode(
-            "{cmp}{pk}".format(
-                cmp=self.cmp,
-                pk=self.pk
-            ).encode("ascii")
-        ).rstrip(b"=").decode("ascii")
 
-    @property
-    def cmp_name(self) -> str:
-        """Return a comparision name usable with Django QuerySet filters."""
-        return {
-            ">": "gt",
-            "<": "lt",
-            ">=": "gte",
-            "<=": "lte"
-        }[self.cmp]
+        :raises ValueError: If the PK is negative or doesn't fit in 62 bits.
+        """
+        return _encode_cursor(self.cmp, self.pk)
 
 
 class MonotonicCursorPagination(pagination.BasePagination):
@@ -104,6 +135,10 @@ class MonotonicCursorPagination(pagination.BasePagination):
     argument's name can be changed using `page_size_query_param` attribute.
     The default value is `page_size` and maximum possible custom value
     is defined by the `max_page_size` attribute.
+
+    Views may define a `pagination_deferred_fields` attribute, listing model
+    fields that the list serializer doesn't need. Those won't be fetched
+    from the database for the paginated results.
     """
 
     pk_field = "pk"
@@ -124,6 +159,8 @@ class MonotonicCursorPagination(pagination.BasePagination):
         # properly set. But it is here just to keep PyCharm's static
         # analyzer happy.
         self.base_url = None
+        self.base_url_parts = None
+        self.base_query = None
         self.cursor = None
         self.next_cursor = None
         self.prev_cursor = None
@@ -131,10 +168,19 @@ class MonotonicCursorPagination(pagination.BasePagination):
     def paginate_queryset(self, queryset, request, view=None):
         """Perform the queryset pagination based on request data."""
         self.base_url = request.build_absolute_uri()
+        # Parse the URL only once, as we need to build up to three links
+        self.base_url_parts = parse.urlsplit(self.base_url)
+        self.base_query = parse.parse_qs(
+            self.base_url_parts.query, keep_blank_values=True
+        )
 
         limit = self.get_page_size(request)
         self.cursor = self.get_cursor(request)
 
+        deferred_fields = getattr(view, "pagination_deferred_fields", None)
+        if deferred_fields:
+            queryset = queryset.defer(*deferred_fields)
+
         order_desc = True
         if self.cursor:
             flt = {f"{self.pk_field}__{self.cursor.cmp_name}": self.cursor.pk}
@@ -147,15 +193,19 @@ class MonotonicCursorPagination(pagination.BasePagination):
 
         if order_desc:
             # Fetch one more item over the limit to see if there is next page
-            results = list(queryset.order_by("-" + self.pk_field)[:limit + 1])
+            queryset = queryset.order_by("-" + self.pk_field)[:limit + 1]
         else:
-            results = list(queryset.order_by(self.pk_field)[:limit])
+            queryset = queryset.order_by(self.pk_field)[:limit]
+        # The queryset is sliced, so this loads the page in a single query
+        results = list(queryset)
+        if not order_desc:
             results.reverse()
 
         if len(results) > limit:
             # Use next item's PK as a reference. Next page should start
-            # with that item, so use "<=" lookup.
-            next_pk = getattr(results[limit], self.pk_field)
+            # with that item, so use "<=" lookup. The item itself doesn't
+            # belong to this page, so we drop it from the results.
+            next_pk = getattr(results.pop(), self.pk_field)
             self.next_cursor = Cursor("<=", next_pk)
         else:
             # There is no more items. We've fetched everything there is.
@@ -185,7 +235,7 @@ class MonotonicCursorPagination(pagination.BasePagination):
             # The client should retry with bare endpoint URL (w/o cursor arg)
             self.prev_cursor = None
 
-        return list(results[:limit])
+        return results
 
     def get_paginated_response(self, data):
         """Return a paginated response with `links` and `results` objects."""
@@ -206,9 +256,12 @@ class MonotonicCursorPagination(pagination.BasePagination):
         """
         if cursor is None:
             return None
-        return replace_query_param(
-            self.base_url, self.cursor_query_param, cursor.encode()
-        )
+        # Same as DRF's `replace_query_param`, but with a pre-parsed URL
+        query = dict(self.base_query)
+        query[self.cursor_query_param] = [cursor.encode()]
+        return parse.urlunsplit(self.base_url_parts._replace(
+            query=parse.urlencode(sorted(query.items()), doseq=True)
+        ))
 
     def get_cursor(self, request) -> Optional[Cursor]:
         """Return the cursor parameter, if provided and None otherwise."""
@@ -228,7 +281,7 @@ class MonotonicCursorPagination(pagination.BasePagination):
         If not requested or invalid value is passed `page_size` is returned.
         """
         limit = request.query_params.get(self.page_size_query_param, None)
-        if limit and re.match(r"^\d+$", limit):
+        if limit and _DIGITS_RE.match(limit):
             limit = int(limit)
             if limit > 0:
                 return min(limit, self.max_page_size)
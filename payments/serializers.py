@@ -1,18 +1,97 @@
-import decimal
+import collections.abc
+import os
+import threading
 import uuid
 
+from django.conf import settings
 from django.db import transaction
+from django.utils.encoding import smart_text
+from django.utils.functional import cached_property
 
 import djmoney.settings
 
 import moneyed
 
 from rest_framework import serializers
+from rest_framework.fields import (
+    SkipField, flatten_choices_dict, to_choices_dict,
+)
+from rest_framework.relations import RelatedField
 
 from . import models
 
 
-class OwnerSerializer(serializers.ModelSerializer):
+# How many random unique IDs to generate with a single urandom call
+_UNIQUE_ID_BATCH_SIZE = 256
+
+_unique_ids = threading.local()
+
+
+def _generate_unique_id():
+    """
+    Generate a random UUIDv4 to use as a payment's unique identifier.
+
+    The randomness is read from the OS in batches, so bursts of payments
+    don't make a system call each. The batches are kept per thread and
+    are generated lazily, so forked worker processes never share them.
+
+    :return: A hex string form of the generated UUID.
+    """
+    pool = getattr(_unique_ids, "pool", None)
+    if not pool:
+        data = os.urandom(16 * _UNIQUE_ID_BATCH_SIZE)
+        pool = _unique_ids.pool = [
+            uuid.UUID(bytes=data[offset:offset + 16], version=4).hex
+            for offset in range(0, len(data), 16)
+        ]
+    return pool.pop()
+
+
+class CurrencyField(serializers.ChoiceField):
+    """
+    A choice field for the supported currencies.
+
+    The set of currencies never changes at runtime, so the choices
+    are processed once, rather than every time a serializer is created.
+    """
+
+    grouped_currency_choices = to_choices_dict(
+        djmoney.settings.CURRENCY_CHOICES
+    )
+    currency_choices = flatten_choices_dict(grouped_currency_choices)
+    currency_strings_to_values = {
+        str(key): key for key in currency_choices
+    }
+
+    def __init__(self, **kwargs):
+        """Initialize the field with the supported currencies as choices."""
+        super().__init__(choices=(), **kwargs)
+        self.grouped_choices = self.grouped_currency_choices
+        self._choices = self.currency_choices
+        self.choice_strings_to_values = self.currency_strings_to_values
+
+
+class BaseModelSerializer(serializers.ModelSerializer):
+    """
+    A ModelSerializer that processes ``Meta.extra_kwargs`` once per class.
+
+    DRF deep-copies ``extra_kwargs`` and merges ``read_only_fields`` into
+    them every time a serializer builds its fields. Those options never
+    change, so they're prepared once, and every instance only gets a
+    shallow copy (DRF modifies the returned dictionaries in place).
+    """
+
+    def get_extra_kwargs(self):
+        """Return a copy of the prepared extra keyword arguments."""
+        cls = type(self)
+        extra_kwargs = cls.__dict__.get("_prebuilt_extra_kwargs", None)
+        if extra_kwargs is None:
+            extra_kwargs = super().get_extra_kwargs()
+            cls._prebuilt_extra_kwargs = extra_kwargs
+        return {name: dict(kwargs) for name, kwargs in extra_kwargs.items()}
+
+
+class OwnerSerializer(BaseModelSerializer):
     """Serializer for the Owner model."""
 
     class Meta:
@@ -26,7 +105,7 @@ class OwnerSerializer(serializers.ModelSerializer):
         }
 
 
-class AccountSerializer(serializers.ModelSerializer):
+class AccountSerializer(BaseModelSerializer):
     """Serializer for the Account model, except for creation."""
 
     owner = serializers.SlugRelatedField(
@@ -50,9 +129,8 @@ class AccountSerializer(serializers.ModelSerializer):
 class AccountCreateSerializer(AccountSerializer):
     """Serializer to create new Account instances."""
 
-    currency = serializers.ChoiceField(
+    currency = CurrencyField(
         required=True,
-        choices=djmoney.settings.CURRENCY_CHOICES,
         help_text="Currency of the account (3-char ISO code from"
                   " the supported options, e.g. \"USD\")"
     )
@@ -76,7 +154,35 @@ class AccountCreateSerializer(AccountSerializer):
         raise RuntimeError("AccountCreateSerializer cannot update accounts")
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class AccountNameField(serializers.SlugRelatedField):
+    """
+    A field for accounts, referred by their names.
+
+    If the parent serializer has a ``prefetched_accounts`` mapping
+    of names to accounts, the accounts are looked up there instead
+    of querying the database.
+    """
+
+    def __init__(self, **kwargs):
+        """Initialize the field, looking up accounts by their names."""
+        kwargs.setdefault("slug_field", "name")
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        """Return the account with the given name."""
+        accounts = getattr(self.parent, "prefetched_accounts", None)
+        if accounts is None or not isinstance(data, str):
+            return super().to_internal_value(data)
+        try:
+            return accounts[data]
+        except KeyError:
+            self.fail(
+                "does_not_exist",
+                slug_name=self.slug_field, value=smart_text(data)
+            )
+
+
+class PaymentSerializer(BaseModelSerializer):
     """
     Serializer for Payment model instances.
 
@@ -87,19 +193,18 @@ class PaymentSerializer(serializers.ModelSerializer):
     # with DRF BrowsableAPIRenderer. It is not a problem for this demo project,
     # as we're using CoreAPI for browsable docs anyway, but keep this in mind
     # if you'll want to change things.
-    from_account = serializers.SlugRelatedField(
-        slug_field="name", queryset=models.Account.objects.select_for_update(),
+    from_account = AccountNameField(
+        queryset=models.Account.objects.select_for_update(),
         required=False, allow_null=True,
         help_text="Account ID to transfer from (omit for deposits)"
     )
-    to_account = serializers.SlugRelatedField(
-        slug_field="name", queryset=models.Account.objects.select_for_update(),
+    to_account = AccountNameField(
+        queryset=models.Account.objects.select_for_update(),
         required=False, allow_null=True,
         help_text="Account ID to transfer to (omit for withdrawals)"
     )
-    currency = serializers.ChoiceField(
+    currency = CurrencyField(
         required=True,
-        choices=djmoney.settings.CURRENCY_CHOICES,
         help_text="Currency of the payment (3-char ISO code from"
                   " the supported options, e.g. \"USD\")."
                   " Must match the account(s)."
@@ -124,7 +229,7 @@ class PaymentSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             "amount": {
                 "required": True,
-                "help_text": "Payment amount",
+                "help_text": "Payment amount, with at most 8 decimal places",
             },
             "unique_id": {
                 "required": False,
@@ -137,9 +242,64 @@ class PaymentSerializer(serializers.ModelSerializer):
             }
         }
 
+    def to_internal_value(self, data):
+        """Fetch (and lock) the payment accounts, then validate the data."""
+        self.prefetched_accounts = None
+        if isinstance(data, collections.abc.Mapping):
+            names = {
+                name for name in (
+                    data.get("from_account", None),
+                    data.get("to_account", None),
+                )
+                if isinstance(name, str) and name
+            }
+            # A single query for both accounts. Ordering by PK makes
+            # concurrent transactions acquire the locks in the same order.
+            accounts = self.fields["from_account"].get_queryset()
+            self.prefetched_accounts = {
+                account.name: account
+                for account in accounts.filter(name__in=names).order_by("pk")
+            } if names else {}
+        return super().to_internal_value(data)
+
+    @cached_property
+    def _field_writers(self):
+        """
+        Return the field names with their bound serialization methods.
+
+        Payments are serialized in lists, with the same child serializer,
+        so the readable fields are only looked up once. Returns ``None``
+        if some field may produce PK-only placeholders, as those need
+        the generic treatment.
+        """
+        fields = self._readable_fields
+        related = (f for f in fields if isinstance(f, RelatedField))
+        if any(field.use_pk_only_optimization() for field in related):
+            return None  # pragma: nocover
+        return tuple(
+            (field.field_name, field.get_attribute, field.to_representation)
+            for field in fields
+        )
+
+    def to_representation(self, instance):
+        """Serialize the payment into a dictionary of primitive values."""
+        writers = self._field_writers
+        if writers is None:  # pragma: nocover
+            return super().to_representation(instance)
+        ret = collections.OrderedDict()
+        for name, get_attribute, to_representation in writers:
+            try:
+                attribute = get_attribute(instance)
+            except SkipField:
+                continue
+            ret[name] = (
+                None if attribute is None else to_representation(attribute)
+            )
+        return ret
+
     def validate(self, attrs):
         """Perform field validation and verify the accounts for the payment."""
-        if transaction.get_autocommit():  # pragma: nocover
+        if settings.DEBUG and transaction.get_autocommit():  # pragma: nocover
             # You must wrap the ViewSet.create in transaction.atomic
             # This check is a safety measure as the code in create relies on
             # transactions and select_for_update in the from/to_account QSes.
@@ -151,7 +311,8 @@ class PaymentSerializer(serializers.ModelSerializer):
             # is not set. It is a bad idea to test against unsupported DB,
             # but this check doesn't hurt as well.
             #
-            # Remove if this somehow blips on perf instrumentation radar.
+            # It is only performed in DEBUG mode, so production requests
+            # don't pay for it - the atomic decorator is authoritative there.
             raise RuntimeError("BUG: The code is not running in a transaction")
 
         validated_data = super().validate(attrs)
@@ -162,28 +323,26 @@ class PaymentSerializer(serializers.ModelSerializer):
 
         # Ensure there is exactly one currency for all the defined account
         # Also ensures at least one account is specified
-        currencies = set()
         if from_account is not None:
-            currencies.add(from_account.currency)
-        if to_account is not None:
-            currencies.add(to_account.currency)
-        if len(currencies) < 1:
+            currency = from_account.currency
+        elif to_account is not None:
+            currency = to_account.currency
+        else:
             raise serializers.ValidationError(
                 "At least one account (from_account or to_account) is required"
             )
-        currencies.add(validated_data["currency"])
-        if len(currencies) != 1:
+        if to_account is not None and to_account.currency != currency:
+            currency = None  # Accounts disagree, so payment can't match
+        if validated_data["currency"] != currency:
             # No currency conversion support for now.
             raise serializers.ValidationError(
                 "Accounts and payment must all use the same currency"
             )
 
-        if isinstance(amount, decimal.Decimal):  # pragma: no branch
-            # Add currency (DRF doesn't do this for us), or comparison'll fail
-            amount = moneyed.Money(amount, next(iter(currencies)))
-
         # If this transfer has a source, ensure no overdraft is possible
-        if from_account is not None and from_account.balance < amount:
+        # The currencies are known to match, so it's enough to compare the
+        # plain Decimal amounts (DRF doesn't give us a Money instance anyway).
+        if from_account is not None and from_account.balance.amount < amount:
             raise serializers.ValidationError(
                 "Source account balance is too low for this payment"
             )
@@ -192,10 +351,13 @@ class PaymentSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         """Perform the requested payment, adjusting the account balances."""
+        # The accounts from validated_data are cached on the instance, so
+        # building the response representation doesn't fetch them again.
         payment = self.Meta.model(**validated_data)
         if not payment.unique_id:
             # TODO: Consider GCing unconfirmed Payments after a while
-            payment.unique_id = str(uuid.uuid4())
+            # Hex form is shorter, so it makes for a smaller unique index
+            payment.unique_id = _generate_unique_id()
             payment.confirmed = False
         else:
             try:
@@ -218,7 +380,7 @@ class PaymentSerializer(serializers.ModelSerializer):
         raise RuntimeError("PaymentSerializer.update is not allowed")
 
 
-class PaymentConfirmSerializer(serializers.ModelSerializer):
+class PaymentConfirmSerializer(BaseModelSerializer):
     """
     Serializer used to confirm payments in the two-step protocol mode.
 
@@ -258,6 +420,13 @@ class PaymentConfirmSerializer(serializers.ModelSerializer):
                 "The only valid value for 'confirmed' is 'true'"
             )
 
+        # The instance was just fetched by the ViewSet without any locks,
+        # so already confirmed payments are detected without waiting for
+        # other confirmations. The flag is re-checked after locking.
+        if instance.confirmed:
+            instance._not_modified = True  # HAX: Signal ViewSet about 304
+            return instance
+
         # Unfortunately, DRF doesn't allow action-dependent use
         # of select_for_update, so we have to re-fetch the objects.
         # See https://github.com/encode/django-rest-framework/issues/4675
@@ -265,24 +434,28 @@ class PaymentConfirmSerializer(serializers.ModelSerializer):
         # Also note we can't do Payment.objects.select_related() here,
         # as SELECT FOR UPDATE doesn't work for the nullable side
         # of the OUTER JOINs.
-        payments = models.Payment.objects.select_for_update()
-        accounts = models.Account.objects.select_for_update()
-
-        payment = payments.get(pk=instance.pk)
+        payment = models.Payment.objects.select_for_update().get(
+            pk=instance.pk
+        )
         if payment.confirmed:
             # TODO: Or maybe throw an exception here?
             payment._not_modified = True  # HAX: Signal ViewSet about 304
             return payment
 
-        # Note: select_related won't create a lock, so select independently
-        if payment.from_account is not None:
-            from_account = accounts.get(pk=payment.from_account.pk)
-        else:
-            from_account = None
-        if payment.to_account is not None:
-            to_account = accounts.get(pk=payment.to_account.pk)
-        else:
-            to_account = None
+        # Lock both accounts at once. Ordering by PK makes concurrent
+        # transactions acquire the locks in the same order.
+        account_ids = [
+            pk for pk in (payment.from_account_id, payment.to_account_id)
+            if pk is not None
+        ]
+        accounts = {
+            account.pk: account
+            for account in models.Account.objects.select_for_update().filter(
+                pk__in=account_ids
+            ).order_by("pk")
+        }
+        from_account = accounts.get(payment.from_account_id, None)
+        to_account = accounts.get(payment.to_account_id, None)
 
         try:
             payment.confirm(
@@ -1,64 +1,85 @@
+import copy
 import decimal
+import importlib
+import pickle
 import random
 import uuid
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 from django.db.models import Sum
+from django.test import SimpleTestCase
 from django.urls import reverse
 
 from moneyed import Money, PHP, USD
 
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIRequestFactory, APITestCase
 
-from . import models, pagination
+from . import models, pagination, serializers, views
+
+
+# Amounts used throughout the tests
+ZERO_USD = Money(0, USD)
+ONE_USD = Money(1, USD)
+TEN_USD = Money(10, USD)
+HUNDRED_USD = Money(100, USD)
+THOUSAND_USD = Money(1000, USD)
+THOUSAND_PHP = Money(1000, PHP)
 
 
 # TODO: Add descriptive error messages in all assertion method calls
-class OwnerTests(APITestCase):
-    """Tests for the Owner model and its API."""
+class OwnerModelTests(SimpleTestCase):
+    """Tests for the Owner model that don't need a database."""
 
     def test_str(self):
         """Test that ``__str__`` magic method returns ``Owner.name``."""
         owner = models.Owner(name="alice")
         self.assertEqual(str(owner), owner.name)
 
+
+class OwnerTests(APITestCase):
+    """Tests for the Owner model and its API."""
+
+    @classmethod
+    def setUpTestData(cls):  # noqa: N802
+        """Set up an owner (bob) for the tests that modify owners."""
+        cls.list_url = reverse("owner-list")
+        cls.owner_bob = models.Owner.objects.create(name="bob")
+
     def test_list_owners(self):
         """Test listing owners."""
-        url = reverse("owner-list")
+        url = self.list_url
 
-        # Try without any owners first
-        self.assertFalse(models.Owner.objects.exists())
+        # Try with just the "bob" fixture first
         res = self.client.get(url, format="json")
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.json()["results"]), 0)
+        self.assertEqual(len(res.json()["results"]), 1)
 
-        # Create a few accounts
-        models.Owner.objects.create(name="alice")
-        models.Owner.objects.create(name="bob")
+        # Create a few more owners
+        models.Owner.objects.bulk_create([
+            models.Owner(name="alice"),
+            models.Owner(name="charlie"),
+        ])
 
-        # Now, test that they're listed
-        res = self.client.get(url, format="json")
+        # Now, test that they're listed (COUNT and a page SELECT)
+        with self.assertNumQueries(2):
+            res = self.client.get(url, format="json")
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(
             # XXX: This could be affected by pagination
             # For simplicity, let us assume that page size is large enough
             len(res.json()["results"]),
-            models.Owner.objects.count()
+            3
         )
 
     def test_create_owner(self):
         """Ensure we can create owner, but only if names are unique."""
-        url = reverse("owner-list")
+        url = self.list_url
 
-        # First, ensure there is no "alice" in the database
-        self.assertFalse(models.Owner.objects.filter(name="alice").exists())
-
-        # Send a POST request to create "alice"
+        # Send a POST request to create "alice" (the fixture only has "bob")
         res = self.client.post(url, {"name": "alice"}, format="json")
-        # And ensure the 201 response and that she exists afterwards
+        # And ensure the 201 response (the checks below prove she exists)
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
-        self.assertTrue(models.Owner.objects.filter(name="alice").exists())
 
         # Now, ensure that attempts to re-create "alice" fail
         res = self.client.post(url, {"name": "alice"}, format="json")
@@ -72,86 +93,77 @@ class OwnerTests(APITestCase):
 
     def test_update_owner(self):
         """Ensure that owners can be renamed."""
-        # Send a POST request to create "alice"
-        url = reverse("owner-list")
-        res = self.client.post(url, {"name": "alice"}, format="json")
-        # And ensure the 201 response and that she exists afterwards
-        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
-        self.assertTrue(models.Owner.objects.filter(name="alice").exists())
-
-        # Now, rename "alice" to "allie"
-        url = reverse("owner-detail", kwargs={"name": "alice"})
-        res = self.client.patch(url, {"name": "allie"}, format="json")
+        # Rename "bob" to "robert"
+        url = reverse("owner-detail", kwargs={"name": "bob"})
+        res = self.client.patch(url, {"name": "robert"}, format="json")
         self.assertEqual(res.status_code, status.HTTP_200_OK)
 
-        # Make sure there is no "alice" anymore
-        self.assertFalse(models.Owner.objects.filter(name="alice").exists())
-        res = self.client.get(url, format="json")
-        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        # Make sure there is no "bob" anymore
+        self.assertFalse(models.Owner.objects.filter(name="bob").exists())
 
-        # And that "allie" now exists
-        self.assertTrue(models.Owner.objects.filter(name="allie").exists())
-        url = reverse("owner-detail", kwargs={"name": "allie"})
+        # And that "robert" now exists
+        url = reverse("owner-detail", kwargs={"name": "robert"})
         res = self.client.get(url, format="json")
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.json()["name"], "allie")
+        self.assertEqual(res.json()["name"], "robert")
 
     def test_delete_owner(self):
-        """Ensure that owners can be renamed."""
-        # Send a POST request to create "alice"
-        url = reverse("owner-list")
-        res = self.client.post(url, {"name": "alice"}, format="json")
-        # And ensure the 201 response and that she exists afterwards
-        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
-        self.assertTrue(models.Owner.objects.filter(name="alice").exists())
-
-        # Create two accounts for "alice", with zero and non-zero balances
-        owner = models.Owner.objects.get(name="alice")
-        models.Account.objects.create(
-            owner=owner, name="alice000", balance=Money(0, USD)
-        )
+        """Ensure that owners can be deleted iif their balances are zero."""
+        # Create two accounts for "bob", with zero and non-zero balances
+        owner = self.owner_bob
+        models.Account.objects.create(owner=owner, name="bob000")
         account = models.Account.objects.create(
-            owner=owner, name="alice001", balance=Money(1, USD)
+            owner=owner, name="bob001", balance=ONE_USD
         )
 
-        # Try to delete "alice". It should fail, because "alice001" has money
-        url = reverse("owner-detail", kwargs={"name": "alice"})
+        # Try to delete "bob". It should fail, because "bob001" has money
+        url = reverse("owner-detail", kwargs={"name": "bob"})
         res = self.client.delete(url, format="json")
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
-        # Make sure both accounts still exist and "alice000" is not gone
+        # Make sure both accounts still exist and "bob000" is not gone
         self.assertEqual(models.Account.objects.filter(owner=owner).count(), 2)
 
-        # Update "alice001" account to have zero balance
+        # Update "bob001" account to have zero balance
         # No payments, just crude patching - sufficient for this test case.
-        account.balance = Money(0, USD)
-        account.save()
+        models.Account.objects.filter(pk=account.pk).update(balance=ZERO_USD)
 
-        # Now, deleting "alice" should be possible
-        url = reverse("owner-detail", kwargs={"name": "alice"})
+        # Now, deleting "bob" should be possible
         res = self.client.delete(url, format="json")
         self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
 
-        # Make sure there is no "alice" anymore
+        # Make sure there is no "bob" anymore
         self.assertFalse(
-            models.Account.objects.filter(owner__name="alice").exists()
+            models.Account.objects.filter(owner_id=owner.pk).exists()
         )
-        self.assertFalse(models.Owner.objects.filter(name="alice").exists())
+        self.assertFalse(models.Owner.objects.filter(name="bob").exists())
+        # This is the only check of the owner-detail 404 path, so keep it
         res = self.client.get(url, format="json")
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
 
 
-class AccountTests(APITestCase):
-    """Tests for the Account model and its API."""
+class AccountModelTests(SimpleTestCase):
+    """Tests for the Account model that don't need a database."""
 
     def test_str(self):
         """Test that ``__str__`` magic method returns ``Account.name``."""
         account = models.Account(name="alice")
         self.assertEqual(str(account), account.name)
 
+
+class AccountTests(APITestCase):
+    """Tests for the Account model and its API."""
+
+    @classmethod
+    def setUpTestData(cls):  # noqa: N802
+        """Set up two owners (alice and bob) for account tests."""
+        cls.list_url = reverse("account-list")
+        cls.owner_alice = models.Owner.objects.create(name="alice")
+        cls.owner_bob = models.Owner.objects.create(name="bob")
+
     def test_list_accounts(self):
         """Test listing accounts."""
-        url = reverse("account-list")
+        url = self.list_url
 
         # Try without any accounts first
         self.assertFalse(models.Account.objects.exists())
@@ -160,48 +172,47 @@ class AccountTests(APITestCase):
         self.assertEqual(len(res.json()["results"]), 0)
 
         # Create a few accounts
-        alice = models.Owner.objects.create(name="alice")
-        models.Account.objects.create(name="alice000", owner=alice)
-        models.Account.objects.create(name="alice001", owner=alice)
-        bob = models.Owner.objects.create(name="bob")
-        models.Account.objects.create(name="bob001", owner=bob)
-
-        # Now, test that they're listed
-        res = self.client.get(url, format="json")
+        alice, bob = self.owner_alice, self.owner_bob
+        models.Account.objects.bulk_create([
+            models.Account(name="alice000", owner=alice),
+            models.Account(name="alice001", owner=alice),
+            models.Account(name="bob001", owner=bob),
+        ])
+
+        # Now, test that they're listed (COUNT and a page SELECT)
+        with self.assertNumQueries(2):
+            res = self.client.get(url, format="json")
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(
             # XXX: This could be affected by pagination
             # For simplicity, let us assume that page size is large enough
             len(res.json()["results"]),
-            models.Account.objects.count()
+            3
         )
 
         # Test filtering by owner
-        res = self.client.get(url, {"owner": "alice"}, format="json")
+        with self.assertNumQueries(2):  # Still no separate owner lookup
+            res = self.client.get(url, {"owner": "alice"}, format="json")
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.json()["results"]), alice.account_set.count())
+        self.assertEqual(len(res.json()["results"]), 2)
         res = self.client.get(url, {"owner": "bob"}, format="json")
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.json()["results"]), bob.account_set.count())
+        self.assertEqual(len(res.json()["results"]), 1)
 
     def test_create_account(self):
         """Ensure we can create an account, but only if names are unique."""
-        url = reverse("account-list")
+        url = self.list_url
         data = {"name": "alice001", "owner": "alice", "currency": "USD"}
 
-        # First, try to create account for non-existent owner "alice"
-        self.assertFalse(models.Owner.objects.filter(name="alice").exists())
-        res = self.client.post(url, data, format="json")
-        # And ensure the 201 response and that she exists afterwards
+        # First, try to create account for non-existent owner "dave"
+        res = self.client.post(
+            url, dict(data, owner="dave"), format="json"
+        )
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
-        # Create "alice" and try again
-        models.Owner.objects.create(name="alice")
+        # Now try again with "alice", who exists
         res = self.client.post(url, data, format="json")
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
-        self.assertTrue(models.Account.objects.filter(
-            name="alice001", owner__name="alice"
-        ).exists())
 
         # And that we're able to fetch "alice001" and it's really correct
         url = reverse("account-detail", kwargs={"name": "alice001"})
@@ -214,13 +225,20 @@ class AccountTests(APITestCase):
 
     def test_delete_account(self):
         """Ensure that accounts can be deleted iif their balance is zero."""
-        # Create user "alice" and two accounts, one with $0, another with $1
-        alice, _unused = models.Owner.objects.get_or_create(name="alice")
-        models.Account.objects.create(
-            name="alice000", owner=alice, balance=Money(0, USD)
-        )
-        models.Account.objects.create(
-            name="alice001", owner=alice, balance=Money(1, USD)
+        # Create two accounts for "alice", one with $0, another with $1
+        alice = self.owner_alice
+        models.Account.objects.bulk_create([
+            models.Account(name="alice000", owner=alice),
+            models.Account(
+                name="alice001", owner=alice, balance=ONE_USD
+            ),
+        ])
+        # A pending payment, which is locked and deleted with the account
+        models.Payment.objects.create(
+            from_account=models.Account.objects.get(name="alice000"),
+            amount=ONE_USD,
+            unique_id="test_delete_account/tx1",
+            confirmed=False,
         )
 
         # Try to delete account with $0 balance and make sure this succeeds.
@@ -231,6 +249,9 @@ class AccountTests(APITestCase):
         self.assertFalse(
             models.Account.objects.filter(name="alice000").exists()
         )
+        self.assertFalse(models.Payment.objects.filter(
+            unique_id="test_delete_account/tx1"
+        ).exists())
 
         # Try to delete account with $1 balance and ensure we can't do this.
         res = self.client.delete(
@@ -248,26 +269,99 @@ class PaymentTests(APITestCase):
     @classmethod
     def setUpTestData(cls):  # noqa: N802
         """Set up three accounts (alice, bob and charlie) for payment tests."""
-        alice = models.Owner.objects.create(name="alice")
-        bob = models.Owner.objects.create(name="bob")
-        charlie = models.Owner.objects.create(name="charlie")
-        cls.account_alice = models.Account.objects.create(
-            name="alice456", owner=alice, balance=Money(0, USD)
+        cls.list_url = reverse("payment-list")
+        cls.factory = APIRequestFactory()
+        cls.list_view = staticmethod(
+            views.PaymentViewSet.as_view({"post": "create"})
         )
-        cls.account_bob = models.Account.objects.create(
-            name="bob123", owner=bob, balance=Money(100, USD)
+        # Not all databases return PKs from bulk_create, so the objects
+        # are fetched back, with a single query for each model.
+        owner_names = ("alice", "bob", "charlie")
+        models.Owner.objects.bulk_create([
+            models.Owner(name=name) for name in owner_names
+        ])
+        owners = models.Owner.objects.in_bulk(owner_names, field_name="name")
+        models.Account.objects.bulk_create([
+            models.Account(name="alice456", owner=owners["alice"]),
+            models.Account(
+                name="bob123", owner=owners["bob"], balance=HUNDRED_USD
+            ),
+            models.Account(
+                name="charlie999", owner=owners["charlie"],
+                balance=THOUSAND_PHP
+            ),
+        ])
+        accounts = models.Account.objects.in_bulk(
+            ("alice456", "bob123", "charlie999"), field_name="name"
         )
-        cls.account_charlie = models.Account.objects.create(
-            name="charlie999", owner=charlie, balance=(1000, PHP)
+        cls.account_alice = accounts["alice456"]
+        cls.account_bob = accounts["bob123"]
+        cls.account_charlie = accounts["charlie999"]
+        cls.initial_balances = tuple(
+            (account, account.balance) for account in accounts.values()
         )
 
+    def setUp(self):  # noqa: N802
+        """Reset the account balances other tests may have reloaded."""
+        super().setUp()
+        # The database changes are rolled back, but the class-level
+        # instances are shared by all tests, so restore their balances.
+        # This is cheaper than querying the database for them.
+        for account, balance in self.initial_balances:
+            account.balance = balance
+
+    def _reload_balances(self, *accounts):
+        """Reload balances of the given accounts with a single query."""
+        # Account currencies never change, so only the amounts are loaded
+        amounts = dict(models.Account.objects.filter(
+            pk__in=[account.pk for account in accounts]
+        ).values_list("pk", "balance"))
+        for account in accounts:
+            account.balance = Money(amounts[account.pk], account.currency)
+
+    def _assert_balances(self, *expected):
+        """Assert balances of the ``(account, balance)`` pairs."""
+        self._reload_balances(*(account for account, _balance in expected))
+        for account, balance in expected:
+            self.assertEqual(account.balance, balance)
+
+    def _post_payment(self, data):
+        """
+        Request a new payment, calling the view directly.
+
+        This skips the middleware, which is irrelevant for the tests
+        that only check payment validation.
+        """
+        request = self.factory.post(self.list_url, data, format="json")
+        return self.list_view(request)
+
+    def _assert_no_overdraft(self, unique_id):
+        """Ensure an immediate withdrawal over Bob's balance is rejected."""
+        initial_balance = self.account_bob.balance
+
+        res = self._post_payment({
+            "from_account": self.account_bob.name,
+            "amount": str((initial_balance + THOUSAND_USD).amount),
+            "currency": "USD",
+            "unique_id": unique_id
+        })
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Ensure no Payment was created
+        self.assertFalse(
+            models.Payment.objects.filter(unique_id=unique_id).exists()
+        )
+
+        # Check account balance
+        self._assert_balances((self.account_bob, initial_balance))
+
     def test_confirm_method(self):
         """Test Payment.confirm behavior."""
         payment = models.Payment.objects.create(
             from_account=self.account_bob,
             to_account=None,
-            amount=Money(1000, USD),
-            unique_id=str(uuid.uuid4()),
+            amount=THOUSAND_USD,
+            unique_id="test_confirm_method/tx1",
             confirmed=False
         )
 
@@ -286,25 +380,37 @@ class PaymentTests(APITestCase):
         with self.assertRaises(ValueError):
             payment.confirm(commit=False)
 
+    def test_generate_unique_id(self):
+        """Test generated unique IDs are distinct UUIDv4s across batches."""
+        count = serializers._UNIQUE_ID_BATCH_SIZE * 2 + 1
+        unique_ids = {serializers._generate_unique_id() for _ in range(count)}
+        self.assertEqual(len(unique_ids), count)
+        for unique_id in unique_ids:
+            self.assertEqual(uuid.UUID(hex=unique_id).version, 4)
+
     def test_deposit(self):
         """Test successfully depositing money."""
-        url = reverse("payment-list")
+        url = self.list_url
 
-        self.account_alice.refresh_from_db(fields=["balance", "currency"])
         initial_balance = self.account_alice.balance
 
         uid_tx1 = f"test_deposit/tx1"
-        res = self.client.post(url, {
-            "to_account": self.account_alice.name,
-            "amount": "100.00",
-            "currency": "USD",
-            "unique_id": uid_tx1
-        }, format="json")
+        # SAVEPOINT, locking SELECT of the accounts, unique_id check,
+        # UPDATE of the account balances, INSERT and RELEASE SAVEPOINT
+        with self.assertNumQueries(6):
+            res = self.client.post(url, {
+                "to_account": self.account_alice.name,
+                "amount": "100.00",
+                "currency": "USD",
+                "unique_id": uid_tx1
+            }, format="json")
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
 
         # Fetch the Payment from database and verify its properties
-        tx1 = models.Payment.objects.select_related().get(unique_id=uid_tx1)
-        self.assertEqual(tx1.amount, Money(100, USD))
+        tx1 = models.Payment.objects.select_related(
+            "to_account"
+        ).get(unique_id=uid_tx1)
+        self.assertEqual(tx1.amount, HUNDRED_USD)
         self.assertIsNone(tx1.from_account)
         self.assertEqual(tx1.to_account, self.account_alice)
 
@@ -312,9 +418,8 @@ class PaymentTests(APITestCase):
         self.assertEqual(tx1.destination_balance_before, initial_balance)
 
         # Check account balance
-        self.account_alice.refresh_from_db(fields=["balance", "currency"])
-        self.assertEqual(
-            self.account_alice.balance, initial_balance + tx1.amount
+        self._assert_balances(
+            (self.account_alice, initial_balance + tx1.amount)
         )
 
         # Test that stringifying the Payment model mentions alice
@@ -329,28 +434,28 @@ class PaymentTests(APITestCase):
         """
         # Test immediate payments that would overdraft
         # Even without the validate method they shouldn't be possible.
-        validator_fmt = "payments.serializers.{cls}.validate"
+        no_validation = {"side_effect": lambda attrs: attrs}
 
-        with patch(validator_fmt.format(cls="PaymentSerializer")) as v:
-            v.side_effect = lambda x: x
-            self.test_no_overdraft()
+        with patch.object(
+            serializers.PaymentSerializer, "validate", **no_validation
+        ) as v:
+            self._assert_no_overdraft("test_overdraft_race/tx0")
             self.assertTrue(v.called)
 
         # Test two-phase protocol with overdraft
         # With a short-circuited validation function it should be possible
         # to create new payment now, but trying to commit must fail
-        with patch(validator_fmt.format(cls="PaymentConfirmSerializer")) as v:
-            v.side_effect = lambda x: x
-
-            self.account_bob.refresh_from_db(fields=["balance", "currency"])
+        with patch.object(
+            serializers.PaymentConfirmSerializer, "validate", **no_validation
+        ) as v:
             initial_balance = self.account_bob.balance
 
             # Just create the Payment directly
             tx1 = models.Payment.objects.create(
                 from_account=self.account_bob,
                 to_account=None,
-                amount=Money(1000, USD),
-                unique_id=str(uuid.uuid4()),
+                amount=THOUSAND_USD,
+                unique_id="test_overdraft_race/tx1",
                 confirmed=False
             )
             url = reverse("payment-detail", kwargs={"pk": tx1.pk})
@@ -364,44 +469,41 @@ class PaymentTests(APITestCase):
             self.assertFalse(tx1.confirmed)
 
             # And account balance shouldn't change
-            self.account_bob.refresh_from_db(fields=["balance", "currency"])
-            self.assertEqual(self.account_bob.balance, initial_balance)
+            self._assert_balances((self.account_bob, initial_balance))
 
             self.assertTrue(v.called)
 
     def test_deposit_no_uid(self):
         """Test depositing money in two steps (without unique_id)."""
-        url = reverse("payment-list")
-
-        self.account_alice.refresh_from_db(fields=["balance", "currency"])
         initial_balance = self.account_alice.balance
 
-        res = self.client.post(url, {
+        res = self._post_payment({
             "to_account": self.account_alice.name,
             "amount": "100.00",
             "currency": "USD",
-        }, format="json")
+        })
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
 
         # Make sure response has unique_id
-        res_data = res.json()
+        res_data = res.data
         uid_tx1 = res_data.get("unique_id", None)
         self.assertIsNotNone(uid_tx1)
         self.assertIn("url", res_data)
 
         # Fetch the Payment from database and verify its properties
-        tx1 = models.Payment.objects.select_related().get(unique_id=uid_tx1)
-        self.assertEqual(tx1.amount, Money(100, USD))
+        tx1 = models.Payment.objects.select_related(
+            "to_account"
+        ).get(unique_id=uid_tx1)
+        self.assertEqual(tx1.amount, HUNDRED_USD)
         self.assertIsNone(tx1.from_account)
         self.assertEqual(tx1.to_account, self.account_alice)
         self.assertFalse(tx1.confirmed)
 
         # Check account balance - it shouldn't have changed yet
-        self.account_alice.refresh_from_db(fields=["balance", "currency"])
-        self.assertEqual(self.account_alice.balance, initial_balance)
+        self._assert_balances((self.account_alice, initial_balance))
 
         # Mess with the account's balance to verify destination_balance_before
-        self.account_alice.balance = initial_balance + Money(1, USD)
+        self.account_alice.balance = initial_balance + ONE_USD
         self.account_alice.save()
         initial_balance = self.account_alice.balance
 
@@ -418,7 +520,7 @@ class PaymentTests(APITestCase):
 
         # Check the payment. It should be confirmed now, but otherwise the same
         tx1.refresh_from_db()
-        self.assertEqual(tx1.amount, Money(100, USD))
+        self.assertEqual(tx1.amount, HUNDRED_USD)
         self.assertIsNone(tx1.from_account)
         self.assertEqual(tx1.to_account, self.account_alice)
         self.assertTrue(tx1.confirmed)
@@ -428,16 +530,14 @@ class PaymentTests(APITestCase):
         self.assertEqual(tx1.destination_balance_before, initial_balance)
 
         # Check account balance - it should have changed now
-        self.account_alice.refresh_from_db(fields=["balance", "currency"])
-        self.assertEqual(
-            self.account_alice.balance, initial_balance + tx1.amount
+        self._assert_balances(
+            (self.account_alice, initial_balance + tx1.amount)
         )
 
     def test_withdrawal_no_uid(self):
         """Test succesfully withdrawing money."""
-        url = reverse("payment-list")
+        url = self.list_url
 
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
         initial_balance = self.account_bob.balance
 
         res = self.client.post(url, {
@@ -454,19 +554,21 @@ class PaymentTests(APITestCase):
         self.assertIn("url", res_data)
 
         # Fetch the Payment from database and verify its properties
-        tx1 = models.Payment.objects.select_related().get(unique_id=uid_tx1)
-        self.assertEqual(tx1.amount, Money(10, USD))
+        tx1 = models.Payment.objects.select_related(
+            "from_account"
+        ).get(unique_id=uid_tx1)
+        self.assertEqual(tx1.amount, TEN_USD)
         self.assertEqual(tx1.from_account, self.account_bob)
         self.assertIsNone(tx1.to_account)
         self.assertFalse(tx1.confirmed)
 
         # Check account balance - it shouldn't have changed yet
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
-        self.assertEqual(self.account_bob.balance, initial_balance)
+        self._assert_balances((self.account_bob, initial_balance))
 
         # Now, temporarily zero the balance (to test for failure)
-        self.account_bob.balance = Money(0, USD)
-        self.account_bob.save(update_fields=["balance"])
+        models.Account.objects.filter(pk=self.account_bob.pk).update(
+            balance=ZERO_USD
+        )
 
         # Try confirming the payment - it should fail
         url = res_data["url"]
@@ -474,9 +576,10 @@ class PaymentTests(APITestCase):
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
         # Fix the balance back (but to a different value)
-        initial_balance = initial_balance + Money(1, USD)
-        self.account_bob.balance = initial_balance
-        self.account_bob.save(update_fields=["balance"])
+        initial_balance = initial_balance + ONE_USD
+        models.Account.objects.filter(pk=self.account_bob.pk).update(
+            balance=initial_balance
+        )
 
         # Confirm the payment
         url = res_data["url"]
@@ -485,7 +588,7 @@ class PaymentTests(APITestCase):
 
         # Check the payment. It should be confirmed now, but otherwise the same
         tx1.refresh_from_db()
-        self.assertEqual(tx1.amount, Money(10, USD))
+        self.assertEqual(tx1.amount, TEN_USD)
         self.assertEqual(tx1.from_account, self.account_bob)
         self.assertIsNone(tx1.to_account)
         self.assertTrue(tx1.confirmed)
@@ -496,8 +599,7 @@ class PaymentTests(APITestCase):
 
         # Check account balance - it should have changed now
         new_balance = initial_balance - tx1.amount
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
-        self.assertEqual(self.account_bob.balance, new_balance)
+        self._assert_balances((self.account_bob, new_balance))
 
         # Check that attempts to re-confirm the payment fail now
         url = res_data["url"]
@@ -505,20 +607,56 @@ class PaymentTests(APITestCase):
         self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
 
         # Check account balance - it should have not changed
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
-        self.assertEqual(self.account_bob.balance, new_balance)
+        self._assert_balances((self.account_bob, new_balance))
+
+    def test_amount_precision(self):
+        """Test that amounts with over 8 decimal places are rejected."""
+        uid_tx1 = "test_amount_precision/tx1"
+        res = self._post_payment({
+            "to_account": self.account_alice.name,
+            "amount": "1.000000001",
+            "currency": "USD",
+            "unique_id": uid_tx1
+        })
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("amount", res.data)
+
+        # Ensure no Payment was created
+        self.assertFalse(
+            models.Payment.objects.filter(unique_id=uid_tx1).exists()
+        )
 
     def test_no_accounts(self):
         """Test that payments without both from and to accounts fail."""
-        url = reverse("payment-list")
-
         uid_tx1 = f"test_no_accounts/tx1"
-        res = self.client.post(url, {
+        res = self._post_payment({
             "amount": "3.14",
             "currency": "USD",
             "unique_id": uid_tx1
+        })
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Ensure no Payment was created
+        self.assertFalse(
+            models.Payment.objects.filter(unique_id=uid_tx1).exists()
+        )
+
+    def test_unknown_account(self):
+        """Test that payments referring to unknown accounts fail."""
+        url = self.list_url
+
+        uid_tx1 = "test_unknown_account/tx1"
+        res = self.client.post(url, {
+            "from_account": self.account_bob.name,
+            "to_account": "nonexistent",
+            "amount": "1.00",
+            "currency": "USD",
+            "unique_id": uid_tx1
         }, format="json")
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res_data = res.json()
+        self.assertIn("to_account", res_data)
+        self.assertNotIn("from_account", res_data)
 
         # Ensure no Payment was created
         self.assertFalse(
@@ -527,8 +665,6 @@ class PaymentTests(APITestCase):
 
     def test_currency_match(self):
         """Test matching account and payment currencies."""
-        url = reverse("payment-list")
-
         # Test our test setup ;)
         self.assertNotEqual(
             self.account_bob.currency, self.account_charlie.currency
@@ -536,109 +672,72 @@ class PaymentTests(APITestCase):
 
         # Try various payment combinations that would've involned
         # different currencies one way or another. Make sure they all fail.
-
-        uid_tx1 = f"test_transfer/tx1"
-        res = self.client.post(url, {
+        data = {
             "from_account": self.account_bob.name,
             "to_account": self.account_charlie.name,
             "amount": "10.00",
-            "currency": "USD",
-            "unique_id": uid_tx1
-        }, format="json")
-        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
-
-        uid_tx2 = f"test_transfer/tx2"
-        res = self.client.post(url, {
-            "from_account": self.account_bob.name,
-            "to_account": self.account_charlie.name,
-            "amount": "10.00",
-            "currency": "PHP",
-            "unique_id": uid_tx2
-        }, format="json")
-        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
-
-        uid_tx3 = f"test_transfer/tx3"
-        res = self.client.post(url, {
-            "from_account": self.account_bob.name,
-            "to_account": self.account_charlie.name,
-            "amount": "10.00",
-            "currency": "XBT",
-            "unique_id": uid_tx3
-        }, format="json")
-        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        }
+        uids = []
+        for idx, currency in enumerate(("USD", "PHP", "XBT"), 1):
+            with self.subTest(currency=currency):
+                uid_tx = f"test_transfer/tx{idx}"
+                uids.append(uid_tx)
+                res = self._post_payment(
+                    dict(data, currency=currency, unique_id=uid_tx)
+                )
+                self.assertEqual(
+                    res.status_code, status.HTTP_400_BAD_REQUEST
+                )
 
         # Confirm than to Payments were created in the database
-        for uid_tx in (uid_tx1, uid_tx2, uid_tx3):
-            self.assertFalse(
-                models.Payment.objects.filter(unique_id=uid_tx).exists()
-            )
-
-    def test_no_overdraft(self):
-        """Test that no overdraft is possible (immediate payment)."""
-        url = reverse("payment-list")
-
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
-        initial_balance = self.account_bob.balance
-
-        uid_tx1 = f"test_no_overdraft/tx1"
-        res = self.client.post(url, {
-            "from_account": self.account_bob.name,
-            "amount": str((initial_balance + Money(1000, USD)).amount),
-            "currency": "USD",
-            "unique_id": uid_tx1
-        }, format="json")
-        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
-
-        # Ensure no Payment was created
         self.assertFalse(
-            models.Payment.objects.filter(unique_id=uid_tx1).exists()
+            models.Payment.objects.filter(unique_id__in=uids).exists()
         )
 
-        # Check account balance
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
-        self.assertEqual(self.account_bob.balance, initial_balance)
+    def test_no_overdraft(self):
+        """Test that no overdraft is possible (immediate payment)."""
+        self._assert_no_overdraft("test_no_overdraft/tx1")
 
     def test_no_overdraft_2pc(self):
         """Test that no overdraft is possible (2PC variant)."""
-        url = reverse("payment-list")
+        url = self.list_url
 
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
         initial_balance = self.account_bob.balance
 
         # Try the two-step protocol variant (only the first step, of course)
         res = self.client.post(url, {
             "from_account": self.account_bob.name,
-            "amount": str((initial_balance + Money(1000, USD)).amount),
+            "amount": str((initial_balance + THOUSAND_USD).amount),
             "currency": "USD",
         }, format="json")
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
         # Check account balance
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
-        self.assertEqual(self.account_bob.balance, initial_balance)
+        self._assert_balances((self.account_bob, initial_balance))
 
     def test_transfer(self):
         """Test money transfer between two accounts."""
-        url = reverse("payment-list")
+        url = self.list_url
 
-        self.account_alice.refresh_from_db(fields=["balance", "currency"])
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
         initial_balance_alice = self.account_alice.balance
         initial_balance_bob = self.account_bob.balance
 
         uid_tx1 = f"test_transfer/tx1"
-        res = self.client.post(url, {
-            "from_account": self.account_bob.name,
-            "to_account": self.account_alice.name,
-            "amount": "10.00",
-            "currency": "USD",
-            "unique_id": uid_tx1
-        }, format="json")
+        with self.assertNumQueries(6):  # See test_deposit
+            res = self.client.post(url, {
+                "from_account": self.account_bob.name,
+                "to_account": self.account_alice.name,
+                "amount": "10.00",
+                "currency": "USD",
+                "unique_id": uid_tx1
+            }, format="json")
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
 
         # Fetch the Payment from database and verify its properties
-        tx1 = models.Payment.objects.select_related().get(unique_id=uid_tx1)
-        self.assertEqual(tx1.amount, Money(10, USD))
+        tx1 = models.Payment.objects.select_related(
+            "from_account", "to_account"
+        ).get(unique_id=uid_tx1)
+        self.assertEqual(tx1.amount, TEN_USD)
         self.assertEqual(tx1.from_account, self.account_bob)
         self.assertEqual(tx1.to_account, self.account_alice)
 
@@ -647,13 +746,9 @@ class PaymentTests(APITestCase):
         self.assertEqual(tx1.destination_balance_before, initial_balance_alice)
 
         # Check account balances
-        self.account_alice.refresh_from_db(fields=["balance", "currency"])
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
-        self.assertEqual(
-            self.account_bob.balance, initial_balance_bob - tx1.amount
-        )
-        self.assertEqual(
-            self.account_alice.balance, initial_balance_alice + tx1.amount
+        self._assert_balances(
+            (self.account_bob, initial_balance_bob - tx1.amount),
+            (self.account_alice, initial_balance_alice + tx1.amount),
         )
 
         # Test that stringifying the Payment model mentions alice and bob
@@ -662,23 +757,25 @@ class PaymentTests(APITestCase):
 
     def test_withdrawal(self):
         """Test succesfully withdrawing money."""
-        url = reverse("payment-list")
+        url = self.list_url
 
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
         initial_balance = self.account_bob.balance
 
         uid_tx1 = f"test_withdrawal/tx1"
-        res = self.client.post(url, {
-            "from_account": self.account_bob.name,
-            "amount": "10.00",
-            "currency": "USD",
-            "unique_id": uid_tx1
-        }, format="json")
+        with self.assertNumQueries(6):  # See test_deposit
+            res = self.client.post(url, {
+                "from_account": self.account_bob.name,
+                "amount": "10.00",
+                "currency": "USD",
+                "unique_id": uid_tx1
+            }, format="json")
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
 
         # Fetch the Payment from database and verify its properties
-        tx1 = models.Payment.objects.select_related().get(unique_id=uid_tx1)
-        self.assertEqual(tx1.amount, Money(10, USD))
+        tx1 = models.Payment.objects.select_related(
+            "from_account"
+        ).get(unique_id=uid_tx1)
+        self.assertEqual(tx1.amount, TEN_USD)
         self.assertEqual(tx1.from_account, self.account_bob)
         self.assertIsNone(tx1.to_account)
 
@@ -686,17 +783,29 @@ class PaymentTests(APITestCase):
         self.assertEqual(tx1.source_balance_before, initial_balance)
 
         # Check account balance
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
-        self.assertEqual(
-            self.account_bob.balance, initial_balance - tx1.amount
+        self._assert_balances(
+            (self.account_bob, initial_balance - tx1.amount)
         )
 
         # Test that stringifying the Payment model mentions bob
         self.assertIn(self.account_bob.name, str(tx1))
 
+    def _create_pagination_payments(self, indices):
+        """Insert unconfirmed deposits to Alice, in a single query."""
+        with self.assertNumQueries(1):
+            models.Payment.objects.bulk_create(
+                models.Payment(
+                    to_account=self.account_alice,
+                    amount=ONE_USD,
+                    unique_id=f"test_pagination/tx{idx}",
+                    confirmed=False,
+                )
+                for idx in indices
+            )
+
     def test_pagination(self):
         """Tests for the Payment pagination and MonotonicCursorPagination."""
-        url = reverse("payment-list") + "?limit=10"
+        url = self.list_url + "?limit=10"
 
         # Check the payments list and make sure it's empty
         res = self.client.get(url, format="json")
@@ -725,13 +834,7 @@ class PaymentTests(APITestCase):
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
         # Generate a hundred of payments. Their data doesn't really matter.
-        for idx in range(0, 100):
-            models.Payment.objects.create(
-                to_account=self.account_alice,
-                amount=Money(1, USD),
-                unique_id=f"test_pagination/tx{idx}",
-                confirmed=False,
-            )
+        self._create_pagination_payments(range(0, 100))
 
         # Iterate from latest data to older items and collect unique_ids
         prev_url = None
@@ -739,7 +842,9 @@ class PaymentTests(APITestCase):
         # Iterate 15 times max, so in case of a bug we won't get stuck
         # With limit=10 and 100 entries, 10 times should be enough
         for idx in range(0, 12):  # pragma: no branch
-            res = self.client.get(url, format="json")
+            # A page of payments, along with their accounts, in one query
+            with self.assertNumQueries(1):
+                res = self.client.get(url, format="json")
             self.assertEqual(res.status_code, status.HTTP_200_OK)
 
             data = res.json()
@@ -767,17 +872,12 @@ class PaymentTests(APITestCase):
         self.assertEqual(len(seen_items), 100)
 
         # Generate another 25 payments.
-        for idx in range(100, 125):
-            models.Payment.objects.create(
-                to_account=self.account_alice,
-                amount=Money(1, USD),
-                unique_id=f"test_pagination/tx{idx}",
-                confirmed=False,
-            )
+        self._create_pagination_payments(range(100, 125))
 
         url = prev_url  # Start from first seen "prev" link
         for idx in range(0, 5):  # pragma: no branch
-            res = self.client.get(url, format="json")
+            with self.assertNumQueries(1):
+                res = self.client.get(url, format="json")
             self.assertEqual(res.status_code, status.HTTP_200_OK)
 
             data = res.json()
@@ -818,7 +918,7 @@ class PaymentTests(APITestCase):
             p.return_value = LimitedPagination()
 
             # Check that page_size is respected
-            url = reverse("payment-list")
+            url = self.list_url
             res = self.client.get(url, format="json")
             self.assertEqual(res.status_code, status.HTTP_200_OK)
 
@@ -853,9 +953,57 @@ class PaymentTests(APITestCase):
             self.assertIn("results", data)
             self.assertEqual(len(data["results"]), 20)
 
+    def test_filter_confirmed(self):
+        """Test filtering payments by their confirmation status."""
+        url = self.list_url
+
+        models.Payment.objects.create(
+            to_account=self.account_alice,
+            amount=ONE_USD,
+            unique_id="test_filter_confirmed/tx1",
+            confirmed=True,
+        )
+        models.Payment.objects.create(
+            to_account=self.account_alice,
+            amount=ONE_USD,
+            unique_id="test_filter_confirmed/tx2",
+            confirmed=False,
+        )
+
+        for value, expected in (("true", True), ("false", False)):
+            res = self.client.get(url, {"confirmed": value}, format="json")
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            results = res.json()["results"]
+            self.assertEqual(len(results), 1)
+            self.assertEqual(results[0]["confirmed"], expected)
+
+    def test_retrieve_not_modified(self):
+        """Test that unchanged payments can be re-fetched with ETags."""
+        tx1 = models.Payment.objects.create(
+            to_account=self.account_alice,
+            amount=ONE_USD,
+            unique_id="test_retrieve_not_modified/tx1",
+            confirmed=False,
+        )
+        url = reverse("payment-detail", kwargs={"pk": tx1.pk})
+
+        res = self.client.get(url, format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        etag = res["ETag"]
+
+        # Nothing has changed, so there's nothing to send
+        res = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Once the payment is confirmed, it's sent in full again
+        models.Payment.objects.filter(pk=tx1.pk).update(confirmed=True)
+        res = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.json()["confirmed"])
+
     def test_integrity(self):
         """Generate of random payments and do integrity checks."""
-        url = reverse("payment-list")
+        url = self.list_url
 
         # Ensure the database is clean. Other tests may have messed with it.
         models.Payment.objects.all().delete()
@@ -903,7 +1051,7 @@ class PaymentTests(APITestCase):
             ))
 
         # Now, validate that account balances match the payments
-        self.account_alice.refresh_from_db(fields=["balance", "currency"])
+        self._reload_balances(self.account_alice, self.account_bob)
         alice_in = self.account_alice.payments_to.filter(confirmed=True)\
             .aggregate(total=Sum("amount"))["total"] or decimal.Decimal(0)
         alice_out = self.account_alice.payments_from.filter(confirmed=True)\
@@ -914,7 +1062,6 @@ class PaymentTests(APITestCase):
             Money(alice_in - alice_out, USD)
         )
 
-        self.account_bob.refresh_from_db(fields=["balance", "currency"])
         bob_in = self.account_bob.payments_to.filter(confirmed=True)\
             .aggregate(total=Sum("amount"))["total"]
         bob_out = self.account_bob.payments_from.filter(confirmed=True)\
@@ -924,3 +1071,44 @@ class PaymentTests(APITestCase):
             self.account_bob.balance,
             Money(bob_in - bob_out, USD)
         )
+
+
+class CursorTests(SimpleTestCase):
+    """Tests for the pagination Cursor tuples."""
+
+    def test_tuple_protocol(self):
+        """Test that cursors can be copied, pickled and replaced."""
+        cursor = pagination.Cursor("<=", 100)
+        self.assertEqual(cursor.cmp_name, "lte")
+        self.assertEqual(copy.copy(cursor), cursor)
+        self.assertEqual(pickle.loads(pickle.dumps(cursor)), cursor)
+        self.assertEqual(cursor._replace(cmp=">").cmp_name, "gt")
+        self.assertEqual(pagination.Cursor.decode(cursor.encode()), cursor)
+
+
+class NarrowMoneyFieldsMigrationTests(SimpleTestCase):
+    """Tests for the precision check of the 0006 migration."""
+
+    migration = importlib.import_module(
+        "payments.migrations.0006_narrow_money_fields"
+    )
+
+    def check_precision(self, *values):
+        """Run the check against models storing the given values."""
+        model = MagicMock()
+        query = model.objects.using.return_value.exclude.return_value
+        query.values_list.return_value.iterator.return_value = [
+            decimal.Decimal(value) for value in values
+        ]
+        apps = MagicMock()
+        apps.get_model.return_value = model
+        self.migration.check_precision(apps, MagicMock())
+
+    def test_rejects_excess_precision(self):
+        """Test that values with over 8 decimal places stop the migration."""
+        with self.assertRaisesRegex(RuntimeError, "1.000000001"):
+            self.check_precision("10", "1.000000001")
+
+    def test_accepts_trailing_zeros(self):
+        """Test that zeros past the 8th decimal place aren't a problem."""
+        self.check_precision("10", "1.50000000", "2.1000000000000", "0E-18")
@@ -1,8 +1,8 @@
 from django.db import IntegrityError, transaction
-
-from django_filters.rest_framework import DjangoFilterBackend
+from django.db.models import Exists, OuterRef, Q
 
 from rest_framework import mixins, response, status, viewsets
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 
 from . import filters, models, pagination, serializers
@@ -39,6 +39,23 @@ class OwnerViewSet(mixins.CreateModelMixin,
     lookup_field = "name"
     serializer_class = serializers.OwnerSerializer
 
+    def get_queryset(self):
+        """
+        Return the owners queryset.
+
+        For the "destroy" action, owners are annotated with ``has_money``,
+        so the balances are checked with the same query that fetches
+        the owner.
+        """
+        queryset = super().get_queryset()
+        if self.action == "destroy":
+            queryset = queryset.annotate(has_money=Exists(
+                models.Account.objects.filter(
+                    owner=OuterRef("pk")
+                ).exclude(balance=0)
+            ))
+        return queryset
+
     def destroy(self, request, *args, **kwargs):
         """
         Delete the account.
@@ -48,7 +65,7 @@ class OwnerViewSet(mixins.CreateModelMixin,
         try:
             with transaction.atomic():
                 instance = self.get_object()
-                if not instance.account_set.exclude(balance=0).exists():
+                if not instance.has_money:
                     # The condition above is merely a check, not a guarantee.
                     # At least, not with all possible serialization levels.
                     # We have `on_delete=PROTECT` on `Account.owner`, so here
@@ -89,12 +106,22 @@ class AccountViewSet(mixins.CreateModelMixin,
     Deletes the account. Only accounts with zero balance can be deleted.
     """
 
-    queryset = models.Account.objects.order_by("name")
+    queryset = models.Account.objects.select_related("owner").order_by("name")
     lookup_field = "name"
     serializer_class = serializers.AccountSerializer
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (filters.FilterBackend,)
     filter_class = filters.AccountFilter
 
+    def get_queryset(self):
+        """
+        Return the accounts queryset.
+
+        For the "destroy" action, the owner isn't needed.
+        """
+        if self.action == "destroy":
+            return models.Account.objects.all()
+        return super().get_queryset()
+
     def get_serializer_class(self):
         """
         Return the appropriate serializer class.
@@ -113,8 +140,23 @@ class AccountViewSet(mixins.CreateModelMixin,
         Delete the account.
 
         Only succeeds if the balance is zero.
+
+        Unknown and non-empty accounts are rejected after a single plain
+        SELECT. Otherwise, two locking queries follow: first the account's
+        payments (which the deletion cascades to) are locked, in the PK
+        order, and only then the account itself, re-checking its balance.
+        This is the same order as PaymentConfirmSerializer.update uses
+        (the payment, then its accounts), so a confirmation running
+        concurrently can't deadlock with us.
         """
         instance = self.get_object()
+        if instance.balance.amount == 0:
+            list(models.Payment.objects.select_for_update().filter(
+                Q(from_account=instance) | Q(to_account=instance)
+            ).order_by("pk").values_list("pk", flat=True))
+            instance = get_object_or_404(
+                self.get_queryset().select_for_update(), pk=instance.pk
+            )
         if instance.balance.amount == 0:
             instance.delete()
             return response.Response(status=status.HTTP_204_NO_CONTENT)
@@ -141,13 +183,24 @@ class PaymentViewSet(mixins.ListModelMixin,
     Performs the new payment. See ``create`` method's docstring for details.
     """
 
+    # Newest first, as MonotonicCursorPagination pages by the descending PK.
+    # Payments refer to accounts by name only, so owners aren't joined.
     queryset = models.Payment.objects.select_related(
-        "from_account__owner", "to_account__owner"
-    ).order_by("pk")
+        "from_account", "to_account"
+    ).order_by("-pk")
     serializer_class = serializers.PaymentSerializer
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (filters.FilterBackend,)
     filter_class = filters.PaymentFilter
     pagination_class = pagination.MonotonicCursorPagination
+    # Balance history is not exposed by the API, and the joined accounts
+    # are only shown by their names, so don't fetch the rest for lists.
+    # Note, the balance and its currency must be deferred together.
+    pagination_deferred_fields = (
+        "source_balance_before", "destination_balance_before",
+        "from_account__owner", "from_account__currency",
+        "from_account__balance",
+        "to_account__owner", "to_account__currency", "to_account__balance",
+    )
 
     def get_serializer_class(self):
         """
@@ -180,11 +233,6 @@ class PaymentViewSet(mixins.ListModelMixin,
             # to switch serializers. But YMMV.
             return response.Response(status=status.HTTP_304_NOT_MODIFIED)
 
-        if hasattr(instance, "_prefetched_objects_cache"):  # pragma: nocover
-            # If 'prefetch_related' has been applied to a queryset, we need to
-            # forcibly invalidate the prefetch cache on the instance.
-            instance._prefetched_objects_cache = {}
-
         return Response(serializer.data)
 
     @transaction.atomic